@@ -1,18 +1,43 @@
 #!/bin/env python
 import os
 import sys
+import argparse
 
 
 def run():
-    try:
-        image = sys.argv[1]
-    except IndexError:
-        print("Usage: python %s <image>" % sys.argv[0])
+    from .session import expand_paths, CLIPBOARD
+
+    parser = argparse.ArgumentParser(prog="ynot3")
+    parser.add_argument("images", nargs="*", help="images or folders to annotate")
+    parser.add_argument(
+        "--from-clipboard", action="store_true", help="annotate the clipboard image"
+    )
+    parser.add_argument("--record", metavar="FILE", help="record the events to FILE")
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="replay the events from FILE without display, printing timings",
+    )
+    args = parser.parse_args()
+
+    images = expand_paths(args.images)
+    if args.from_clipboard:
+        images.insert(0, CLIPBOARD)
+    if not images:
+        parser.print_usage()
+        sys.exit(1)
+
+    if args.replay:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        from .replay import replay
+
+        if not replay(args.replay, images):
+            sys.exit(1)
     else:
         os.environ["SDL_VIDEODRIVER"] = "x11"
         from .gui import main
 
-        main(image)
+        main(images, record=args.record)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,8 @@
 import os
 import io
 import pygame
-import subprocess
 
+from .clipboard import copy_image, encode_png
 from .colors import GREY, SELECTED_COLOR
 from .widgets import Button
 from . import shapes
@@ -30,7 +30,12 @@ class SaveBut(Button):
         super().__init__(gui, "")
 
     def execute(self):
-        pygame.image.save(self.gui.get_annotated_image(), OUTPUT_FILENAME)
+        image = self.gui.get_annotated_image()
+        if self.gui.dry_run:
+            name = os.path.basename(self.gui.output_filename)
+            pygame.image.save(image, io.BytesIO(), name)
+        else:
+            pygame.image.save(image, self.gui.output_filename)
 
 
 class CopyBut(Button):
@@ -38,18 +43,11 @@ class CopyBut(Button):
         super().__init__(gui, "")
 
     def execute(self):
-        if os.environ.get("WAYLAND_DISPLAY"):
-            proc = subprocess.Popen(
-                ["wl-copy", "-t", "image/png"], stdin=subprocess.PIPE
-            )
+        image = self.gui.get_annotated_image()
+        if self.gui.dry_run:
+            encode_png(image)
         else:
-            proc = subprocess.Popen(
-                ["xclip", "-selection", "clipboard", "-t", "image/png"],
-                stdin=subprocess.PIPE,
-            )
-        buffer = io.BytesIO()
-        pygame.image.save(self.gui.get_annotated_image(), buffer, "png")
-        proc.communicate(input=buffer.getvalue())
+            copy_image(image)
 
 
 class BackBut(Button):
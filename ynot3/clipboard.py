@@ -0,0 +1,36 @@
+import os
+import io
+import pygame
+import subprocess
+
+
+def _wayland():
+    return bool(os.environ.get("WAYLAND_DISPLAY"))
+
+
+def encode_png(surface: pygame.Surface) -> bytes:
+    buffer = io.BytesIO()
+    pygame.image.save(surface, buffer, "png")
+    return buffer.getvalue()
+
+
+def copy_image(surface: pygame.Surface):
+    "Puts `surface` into the clipboard as a PNG image"
+    if _wayland():
+        proc = subprocess.Popen(["wl-copy", "-t", "image/png"], stdin=subprocess.PIPE)
+    else:
+        proc = subprocess.Popen(
+            ["xclip", "-selection", "clipboard", "-t", "image/png"],
+            stdin=subprocess.PIPE,
+        )
+    proc.communicate(input=encode_png(surface))
+
+
+def paste_image() -> pygame.Surface:
+    "Decodes the PNG image found in the clipboard, without any temporary file"
+    if _wayland():
+        command = ["wl-paste", "-n", "-t", "image/png"]
+    else:
+        command = ["xclip", "-selection", "clipboard", "-t", "image/png", "-o"]
+    data = subprocess.check_output(command)
+    return pygame.image.load(io.BytesIO(data), "png")
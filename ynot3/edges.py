@@ -0,0 +1,107 @@
+from array import array
+import pygame
+
+BLOCK_SIZE = 16
+THRESHOLD = 48
+
+
+def _gradient(surface: pygame.Surface, shift: tuple[int, int]) -> pygame.Surface:
+    """Absolute difference between each pixel and the previous one along `shift`
+
+    An edge is thus located on the first pixel after the transition, matching
+    the exclusive end of a `pygame.Rect` around the content"""
+    # max(0, pixel - previous)
+    rising = surface.copy()
+    rising.blit(surface, shift, special_flags=pygame.BLEND_RGB_SUB)
+    # max(0, previous - pixel)
+    falling = pygame.Surface(surface.get_size(), 0, 32)
+    falling.blit(surface, shift)
+    falling.blit(surface, (0, 0), special_flags=pygame.BLEND_RGB_SUB)
+    rising.blit(falling, (0, 0), special_flags=pygame.BLEND_RGB_ADD)
+    return rising
+
+
+def _strengths(gradient: pygame.Surface, horizontal: bool) -> list[bytes]:
+    """Block averages of the gradient, as one profile per tile
+
+    For horizontal edges, each profile gives the strength of every row within
+    a column of tiles, for vertical edges the strength of every column within
+    a row of tiles"""
+    width, height = gradient.get_size()
+    if horizontal:
+        cols = max(1, -(-width // BLOCK_SIZE))
+        small = pygame.transform.smoothscale(gradient, (cols, height))
+        red = pygame.image.tobytes(small, "RGB")[0::3]
+        return [red[col::cols] for col in range(cols)]
+    rows = max(1, -(-height // BLOCK_SIZE))
+    small = pygame.transform.smoothscale(gradient, (width, rows))
+    red = pygame.image.tobytes(small, "RGB")[0::3]
+    return [red[row * width : (row + 1) * width] for row in range(rows)]
+
+
+def _peaks(strengths: bytes) -> list[int]:
+    "Local maxima above the threshold, ignoring the image border"
+    return [
+        i
+        for i in range(1, len(strengths) - 1)
+        if strengths[i] >= THRESHOLD
+        and strengths[i] > strengths[i - 1]
+        and strengths[i] >= strengths[i + 1]
+    ]
+
+
+def _nearest(peaks: list[int], length: int, distance: int) -> array:
+    "Lookup table giving the closest peak of every coordinate, or -1"
+    table = array("i", [-1]) * length
+    best = array("i", [distance + 1]) * length
+    for peak in peaks:
+        for i in range(max(0, peak - distance), min(length, peak + distance + 1)):
+            if abs(i - peak) < best[i]:
+                best[i] = abs(i - peak)
+                table[i] = peak
+    return table
+
+
+class EdgeIndex:
+    """Strong horizontal & vertical edges of an image, per tile
+
+    Only the edges found in the tile under the cursor are considered.
+    Built once per image, then `lookup` is a constant time table access"""
+
+    def __init__(
+        self,
+        background: pygame.Surface,
+        distance: int,
+        offset: tuple[int, int] = (0, 0),
+    ):
+        self.offset = offset
+        self.size = background.get_size()
+        width, height = self.size
+        gray = pygame.Surface((width, height), 0, 32)
+        gray.blit(background, (0, 0))
+        gray = pygame.transform.grayscale(gray)
+
+        # closest horizontal edge for every y, one table per column of tiles
+        self.rows = [
+            _nearest(_peaks(profile), height, distance)
+            for profile in _strengths(_gradient(gray, (0, 1)), True)
+        ]
+        # closest vertical edge for every x, one table per row of tiles
+        self.cols = [
+            _nearest(_peaks(profile), width, distance)
+            for profile in _strengths(_gradient(gray, (1, 0)), False)
+        ]
+
+    def lookup(self, coord: tuple[int, int] | list[int]) -> list[int | None]:
+        "Returns the closest edge for each axis of `coord` (None when too far)"
+        x = coord[0] - self.offset[0]
+        y = coord[1] - self.offset[1]
+        width, height = self.size
+        if not (0 <= x < width and 0 <= y < height):
+            return [None, None]
+        col = self.cols[y * len(self.cols) // height][x]
+        row = self.rows[x * len(self.rows) // width][y]
+        return [
+            None if col < 0 else col + self.offset[0],
+            None if row < 0 else row + self.offset[1],
+        ]
@@ -1,28 +1,78 @@
 import os
+import sys
+import threading
 import pygame
 
 from .widgets import StatusBar
 from .colors import GREY
-from .buttons import BigSmallBut, SaveBut, CopyBut, BackBut, ClearBut
+from .buttons import (
+    BigSmallBut,
+    SaveBut,
+    CopyBut,
+    BackBut,
+    ClearBut,
+    OUTPUT_FILENAME,
+)
+from .edges import EdgeIndex
+from .session import Session, LOAD_ERRORS
+from .replay import Recorder, checksums
 from . import shapes
 
 
 class Snap:
     level = int(os.environ.get("SNAPPING", 8))
+    edge_distance = int(os.environ.get("SNAP_EDGES", 0))
+    edges: EdgeIndex | None = None
+    _indexed: pygame.Surface | None = None
+
+    @classmethod
+    def indexEdges(cls, background: pygame.Surface, offset: tuple[int, int]):
+        "Builds the edge index of `background` without blocking the caller"
+        cls.edges = None
+        cls._indexed = background
+        if not cls.edge_distance:
+            return None
+
+        def build():
+            index = EdgeIndex(background, cls.edge_distance, offset)
+            if cls._indexed is background:
+                cls.edges = index
+
+        thread = threading.Thread(target=build, daemon=True)
+        thread.start()
+        return thread
 
     @classmethod
     def getSnapped(cls, coord: tuple[int, int]) -> list[int]:
         lvl = cls.level
         if not lvl:
-            return list(coord)
-        return [
-            ((lvl // 2 + coord[0]) // lvl) * lvl,
-            ((lvl // 2 + coord[1]) // lvl) * lvl,
-        ]
+            snapped = list(coord)
+        else:
+            snapped = [
+                ((lvl // 2 + coord[0]) // lvl) * lvl,
+                ((lvl // 2 + coord[1]) // lvl) * lvl,
+            ]
+        return cls._edgeSnapped(coord, snapped)
+
+    @classmethod
+    def getEdgeSnapped(cls, coord: tuple[int, int]) -> list[int]:
+        "Only snaps to the image edges, other axes keep the raw position"
+        return cls._edgeSnapped(coord, list(coord))
+
+    @classmethod
+    def _edgeSnapped(cls, coord: tuple[int, int], snapped: list[int]) -> list[int]:
+        edges = cls.edges
+        if edges:
+            for axis, value in enumerate(edges.lookup(coord)):
+                if value is not None:
+                    snapped[axis] = value
+        return snapped
 
 
 class GUI:
     statusbar_height = 40
+    # when set, saving & copying only encode the image, eg: for a replay
+    dry_run = False
 
     def __init__(self, background: pygame.Surface) -> None:
         self.objects: list[shapes.Shape] = []
@@ -31,15 +81,28 @@ class GUI:
         self.but_save = SaveBut(self)
         self.but_clear = ClearBut(self)
         self.but_copy = CopyBut(self)
-        self.dirty_statusbar = True
-        self.dirty_annotation = True
-        buttons = [
+        self.buttons = [
             self.but_undo,
             self.but_copy,
             self.but_save,
             BigSmallBut(self),
             self.but_clear,
         ]
+        self.load(background)
+
+    def load(
+        self, background: pygame.Surface, objects=None, output_filename=OUTPUT_FILENAME
+    ) -> None:
+        "Switches to a new image, optionally restoring its annotations"
+        self.objects = objects or []
+        self.output_filename = output_filename
+        self.dragging = False
+        shapes.Bullet._counter = sum(
+            isinstance(obj, shapes.Bullet) for obj in self.objects
+        )
+        self.dirty_statusbar = True
+        self.dirty_annotation = True
+        buttons = self.buttons
         bg_rect = background.get_rect()
         self.statusbar_height = StatusBar.getHeight(bg_rect.width, buttons)
         self.screen = pygame.display.set_mode(
@@ -55,18 +118,26 @@ class GUI:
         )
 
         self.background = background
-        self.statusbar_surface = pygame.Surface(
-            (self.screen.get_width(), self.statusbar_height), pygame.SRCALPHA
-        ).convert_alpha()
+        shapes.budget.restore()
+        self.statusbar_surface = shapes.budget.track(
+            pygame.Surface(
+                (self.screen.get_width(), self.statusbar_height), pygame.SRCALPHA
+            ).convert_alpha()
+        )
+        previous = getattr(self, "statusbar", None)  # None on first load
         self.statusbar = StatusBar(
             self.statusbar_surface, buttons, self.statusbar_height
         )
-        self.annotation_overlay = pygame.Surface(
-            self.background.get_size(), pygame.SRCALPHA
-        ).convert_alpha()
+        if previous:
+            self.statusbar.selected_color = previous.selected_color
+            self.statusbar.selected_shape = previous.selected_shape
+        self.annotation_overlay = shapes.budget.track(
+            pygame.Surface(self.background.get_size(), pygame.SRCALPHA).convert_alpha()
+        )
+        self.edge_indexer = Snap.indexEdges(background, (0, self.statusbar_height))
 
     def get_annotated_image(self):
-        surface = pygame.Surface(self.background.get_size(), pygame.SRCALPHA)
+        surface = shapes.budget.surface(self.background.get_size(), pygame.SRCALPHA)
         surface.blit(self.background, (0, 0))
         surface.blit(self.annotation_overlay, (0, 0))
         return surface
@@ -100,7 +171,8 @@ class GUI:
                         self.dirty_annotation = True
             elif event.type == pygame.MOUSEMOTION:
                 if self.dragging:
-                    pos = list(event.pos)
+                    # no grid during the drag, only the edges (once indexed)
+                    pos = Snap.getEdgeSnapped(event.pos)
                     pos[1] -= self.statusbar_height
                     if self.objects:
                         self.objects[-1].end = pos
@@ -130,14 +202,65 @@ class GUI:
             pygame.display.flip()
 
 
-def main(image_path: str):
+def process_event(gui: GUI, session: Session, event) -> bool:
+    "Handles one event, returns False when the application should quit"
+    if event.type == pygame.QUIT:
+        return False
+    if event.type == pygame.WINDOWEXPOSED:
+        gui.dirty_statusbar = True
+        gui.dirty_annotation = True
+    elif event.type in (
+        pygame.MOUSEBUTTONDOWN,
+        pygame.MOUSEBUTTONUP,
+        pygame.MOUSEMOTION,
+        pygame.BUTTON_WHEELDOWN,
+        pygame.BUTTON_WHEELUP,
+    ):
+        gui.handle_event(event)
+    elif event.type == pygame.KEYDOWN:
+        if event.key == pygame.K_s:
+            gui.but_save.execute()
+        elif event.key == pygame.K_ESCAPE:
+            return False
+        elif event.key == pygame.K_c:
+            gui.but_clear.execute()
+        elif event.key == pygame.K_BACKSPACE:
+            gui.but_undo.execute()
+        elif event.key == pygame.K_r:
+            gui.statusbar.selected_shape = shapes.Rectangle
+            gui.dirty_statusbar = True
+        elif event.key == pygame.K_a:
+            gui.statusbar.selected_shape = shapes.Arrow
+            gui.dirty_statusbar = True
+        elif event.key == pygame.K_e:
+            gui.statusbar.selected_shape = shapes.Bullet
+            gui.dirty_statusbar = True
+        elif event.key in (pygame.K_RIGHT, pygame.K_PAGEDOWN):
+            switch_image(gui, session, 1)
+        elif event.key in (pygame.K_LEFT, pygame.K_PAGEUP):
+            switch_image(gui, session, -1)
+    return True
+
+
+def main(image_paths: list[str], record: str | None = None):
     pygame.init()
-    pygame.display.set_caption("Draw Shapes")
 
-    background = pygame.image.load(image_path)
+    session = Session(image_paths)
+    try:
+        background = session.background
+    except LOAD_ERRORS as err:
+        sys.exit("Can't load %s: %s" % (session.path, err))
 
     # Create the GUI
     gui = GUI(background)
+    gui.output_filename = session.output_path(session.path)
+    pygame.display.set_caption(session.caption)
+    session.prefetch()
+
+    recorder = Recorder(record) if record else None
+    if recorder:
+        recorder.image(gui.background)
+    visited = [session.path]
 
     clock = pygame.time.Clock()
     # Game loop
@@ -145,41 +268,74 @@ def main(image_path: str):
 
     while running:
         # Update the screen
-        gui.draw(forced=True)
+        gui.draw()
         # Handle events
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+            background = gui.background
+            if recorder:
+                recorder.event(event)
+            if not process_event(gui, session, event):
                 running = False
-            else:
-                if event.type in (
-                    pygame.MOUSEBUTTONDOWN,
-                    pygame.MOUSEBUTTONUP,
-                    pygame.MOUSEMOTION,
-                    pygame.BUTTON_WHEELDOWN,
-                    pygame.BUTTON_WHEELUP,
-                ):
-                    gui.handle_event(event)
-                else:
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_s:
-                            gui.but_save.execute()
-                        elif event.key == pygame.K_ESCAPE:
-                            running = False
-                        elif event.key == pygame.K_c:
-                            gui.but_clear.execute()
-                        elif event.key == pygame.K_BACKSPACE:
-                            gui.but_undo.execute()
-                        elif event.key == pygame.K_r:
-                            gui.statusbar.selected_shape = shapes.Rectangle
-                            gui.dirty_statusbar = True
-                        elif event.key == pygame.K_a:
-                            gui.statusbar.selected_shape = shapes.Arrow
-                            gui.dirty_statusbar = True
-                        elif event.key == pygame.K_e:
-                            gui.statusbar.selected_shape = shapes.Bullet
-                            gui.dirty_statusbar = True
+                break
+            if recorder and gui.background is not background:
+                recorder.image(gui.background)
+                if session.path not in visited:
+                    visited.append(session.path)
         clock.tick(60)
 
+    if recorder:
+        recorder.close(checksums(gui, session, visited))
     gui.but_copy.execute()
+    if len(session.paths) > 1:
+        save_all(gui, session)
+    if shapes.RENDER_STATS:
+        print("render memory: %s" % shapes.budget, file=sys.stderr)
     # Quit pygame
     pygame.quit()
+
+
+def switch_image(gui: GUI, session: Session, offset: int):
+    index = session.index
+    if not session.move(offset, gui.objects):
+        return
+    try:
+        background = session.background
+    except LOAD_ERRORS as err:
+        print("Skipping %s: %s" % (session.path, err))
+        broken = session.index
+        session.index = index
+        session.discard(broken)
+        # stay on the current image if there is no other one in that direction
+        gui.dirty_annotation = True
+        pygame.display.set_caption(session.caption)
+        switch_image(gui, session, offset)
+        return
+    gui.load(background, session.objects, session.output_path(session.path))
+    pygame.display.set_caption(session.caption)
+    session.prefetch()
+
+
+def render(background: pygame.Surface, objects: list[shapes.Shape]) -> pygame.Surface:
+    "Draws `objects` over `background`, without using the display"
+    overlay = shapes.budget.surface(background.get_size(), pygame.SRCALPHA)
+    for shape in objects:
+        shape.draw(overlay)
+    surface = shapes.budget.surface(background.get_size(), pygame.SRCALPHA)
+    surface.blit(background, (0, 0))
+    surface.blit(overlay, (0, 0))
+    for shape in objects:
+        shape.drop_cache()
+    return surface
+
+
+def save_all(gui: GUI, session: Session):
+    "Saves every annotated image of the session to its own file"
+    session.move(0, gui.objects)
+    for path, objects in session.annotations.items():
+        if objects:
+            try:
+                background = session.image(path)
+            except LOAD_ERRORS as err:
+                print("Can't save %s: %s" % (path, err))
+                continue
+            pygame.image.save(render(background, objects), session.output_path(path))
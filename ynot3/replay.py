@@ -0,0 +1,177 @@
+import sys
+import json
+import time
+import hashlib
+import pygame
+
+from . import shapes
+
+# Event attributes needed to replay the events handled by the GUI
+EVENT_ATTRIBUTES = ("pos", "rel", "button", "buttons", "key", "mod")
+
+
+def image_hash(surface: pygame.Surface) -> str:
+    return hashlib.sha256(pygame.image.tobytes(surface, "RGBA")).hexdigest()
+
+
+def settings() -> dict:
+    "The settings changing the annotated images"
+    from .gui import Snap
+
+    return {
+        "SNAPPING": Snap.level,
+        "SNAP_EDGES": Snap.edge_distance,
+        "RENDER_BUDGET": shapes.budget.limit // 2**20,
+        "SUPERSAMPLE": shapes.budget.supersample,
+    }
+
+
+def apply_settings(values: dict):
+    from .gui import Snap
+
+    Snap.level = values["SNAPPING"]
+    Snap.edge_distance = values["SNAP_EDGES"]
+    shapes.budget.limit = values["RENDER_BUDGET"] * 2**20
+    shapes.budget.supersample = shapes.SUPERSAMPLE = values["SUPERSAMPLE"]
+
+
+def checksums(gui, session, paths) -> list[tuple[str, str, str]]:
+    """Renders the annotated version of `paths`
+
+    Returns the path, the hash of the original image and the hash of the result"""
+    from .gui import render
+
+    session.move(0, gui.objects)
+    result = []
+    for path in paths:
+        background = session.image(path)
+        image = render(background, session.annotations.get(path, []))
+        result.append((path, image_hash(background), image_hash(image)))
+    return result
+
+
+class Recorder:
+    """Logs the events of a session, one JSON object per line
+
+    The settings are logged first, every image shown is logged with its hash so a
+    replay can check its input, and the checksums of the annotated images are
+    logged last so the replay can check its output"""
+
+    def __init__(self, filename: str):
+        self.file = open(filename, "w")
+        self.start = time.perf_counter()
+        self._write({"settings": settings()})
+
+    def _write(self, entry: dict):
+        self.file.write(json.dumps(entry) + "\n")
+
+    def image(self, background: pygame.Surface):
+        self._write({"image": image_hash(background)})
+
+    def event(self, event):
+        entry = {
+            "t": round(time.perf_counter() - self.start, 6),
+            "type": pygame.event.event_name(event.type),
+        }
+        for attr in EVENT_ATTRIBUTES:
+            if hasattr(event, attr):
+                value = getattr(event, attr)
+                entry[attr] = list(value) if isinstance(value, tuple) else value
+        self._write(entry)
+
+    def close(self, results: list[tuple[str, str, str]]):
+        self._write({"checksums": {source: output for _, source, output in results}})
+        self.file.close()
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+def replay(filename: str, image_paths: list[str]) -> bool:
+    """Feeds a recorded session to the GUI, as fast as possible, using its settings
+
+    Prints the time taken to handle & draw each event type, and the checksum
+    of every annotated image. Returns False if the input or output images don't
+    match the recording
+    """
+    from .gui import GUI, process_event
+    from .session import Session, LOAD_ERRORS
+
+    with open(filename) as log:
+        entries = [json.loads(line) for line in log]
+    expected: dict[str, str] = {}
+    for entry in entries:
+        if "settings" in entry:
+            apply_settings(entry["settings"])
+        elif "checksums" in entry:
+            expected = entry["checksums"]
+
+    pygame.init()
+    session = Session(image_paths)
+    try:
+        background = session.background
+    except LOAD_ERRORS as err:
+        sys.exit("Can't load %s: %s" % (session.path, err))
+    gui = GUI(background)
+    gui.dry_run = True
+    latencies: dict[str, list[float]] = {}
+    visited = [session.path]
+
+    for entry in entries:
+        if gui.edge_indexer:
+            # snapping must not depend on the indexing speed
+            gui.edge_indexer.join()
+            gui.edge_indexer = None
+        if "image" in entry:
+            if entry["image"] != image_hash(gui.background):
+                print("Image mismatch for %s" % session.path)
+                pygame.quit()
+                return False
+            continue
+        if "type" not in entry:
+            continue
+        name = entry.pop("type")
+        event_type = getattr(pygame, name.upper(), None)
+        if event_type is None:
+            continue
+        del entry["t"]
+        event = pygame.event.Event(event_type, entry)
+        start = time.perf_counter()
+        running = process_event(gui, session, event)
+        gui.draw()
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if session.path not in visited:
+            visited.append(session.path)
+        if not running:
+            break
+
+    results = checksums(gui, session, visited)
+
+    print("settings: %s" % ", ".join("%s=%s" % item for item in settings().items()))
+    print("%-16s %6s %9s %9s %9s" % ("event", "count", "mean ms", "p95 ms", "max ms"))
+    for name, values in sorted(latencies.items()):
+        print(
+            "%-16s %6d %9.2f %9.2f %9.2f"
+            % (
+                name,
+                len(values),
+                1000 * sum(values) / len(values),
+                1000 * percentile(values, 0.95),
+                1000 * max(values),
+            )
+        )
+    success = True
+    for path, source, output in results:
+        if source not in expected:
+            status = "not recorded"
+        elif expected[source] == output:
+            status = "ok"
+        else:
+            status = "MISMATCH"
+            success = False
+        print("%s %s %s" % (output, path, status))
+    print("render memory: %s" % shapes.budget)
+    pygame.quit()
+    return success
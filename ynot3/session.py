@@ -0,0 +1,195 @@
+import os
+import threading
+import subprocess
+from collections import OrderedDict
+import pygame
+
+from .buttons import OUTPUT_FILENAME
+from .clipboard import paste_image
+from . import shapes
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp", ".tga")
+
+# Decoded images kept in memory, in MB
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", 512))
+
+# Source name used for the image read from the clipboard
+CLIPBOARD = "<clipboard>"
+
+# Raised by the image loader when an image can't be decoded
+LOAD_ERRORS = (pygame.error, OSError, subprocess.CalledProcessError)
+
+
+def load_image(source: str) -> pygame.Surface:
+    if source == CLIPBOARD:
+        try:
+            return paste_image()
+        except subprocess.CalledProcessError as err:
+            raise pygame.error("no PNG image in the clipboard") from err
+        except FileNotFoundError as err:
+            message = "%s is required to read the clipboard" % err.filename
+            raise pygame.error(message) from err
+    return pygame.image.load(source)
+
+
+def expand_paths(args: list[str]) -> list[str]:
+    "Replaces the folders in `args` with the images they contain"
+    paths: list[str] = []
+    for arg in args:
+        if os.path.isdir(arg):
+            paths.extend(
+                os.path.join(arg, name)
+                for name in sorted(os.listdir(arg))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            paths.append(arg)
+    return paths
+
+
+def surface_size(surface: pygame.Surface) -> int:
+    "Memory used by the pixels of `surface`, in bytes"
+    return surface.get_bytesize() * surface.get_width() * surface.get_height()
+
+
+class ImageCache:
+    "Least recently used decoded images, bounded by a memory budget"
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.images: OrderedDict[str, pygame.Surface] = OrderedDict()
+
+    def get(self, path: str) -> pygame.Surface | None:
+        image = self.images.get(path)
+        if image is not None:
+            self.images.move_to_end(path)
+        return image
+
+    def put(self, path: str, image: pygame.Surface):
+        if path in self.images:
+            self.used -= surface_size(self.images.pop(path))
+        self.images[path] = image
+        self.used += surface_size(image)
+        # never evict the image we just added
+        while self.used > self.budget and len(self.images) > 1:
+            _, evicted = self.images.popitem(last=False)
+            self.used -= surface_size(evicted)
+
+
+class Session:
+    """A list of images annotated one after the other
+
+    The next image is decoded in the background while the current one is edited"""
+
+    def __init__(self, paths: list[str], loader=load_image):
+        self.paths = paths
+        self.index = 0
+        self.outputs = self._output_names(paths)
+        self.loader = loader
+        self.cache = ImageCache(CACHE_SIZE * 1024 * 1024)
+        self.annotations: dict[str, list[shapes.Shape]] = {}
+        self._lock = threading.Lock()
+        self._prefetching: dict[str, threading.Thread] = {}
+
+    @property
+    def path(self) -> str:
+        return self.paths[self.index]
+
+    @staticmethod
+    def _output_names(paths: list[str]) -> dict[str, str]:
+        "Unique output file for each path, numbered when the names collide"
+        if len(paths) == 1:
+            return {paths[0]: OUTPUT_FILENAME}
+        root, ext = os.path.splitext(OUTPUT_FILENAME)
+        outputs: dict[str, str] = {}
+        for path in paths:
+            if path in outputs:
+                continue
+            name = "clipboard" if path == CLIPBOARD else os.path.basename(path)
+            base = output = "%s-%s%s" % (root, os.path.splitext(name)[0], ext)
+            counter = 1
+            while output in outputs.values():
+                counter += 1
+                output = "%s-%d%s" % (os.path.splitext(base)[0], counter, ext)
+            outputs[path] = output
+        return outputs
+
+    def output_path(self, path: str) -> str:
+        "Where the annotated version of `path` is saved"
+        return self.outputs[path]
+
+    @property
+    def caption(self) -> str:
+        if len(self.paths) == 1:
+            return "Draw Shapes"
+        return "Draw Shapes - %s (%d/%d)" % (
+            os.path.basename(self.path),
+            self.index + 1,
+            len(self.paths),
+        )
+
+    @property
+    def objects(self) -> list[shapes.Shape]:
+        return self.annotations.get(self.path, [])
+
+    @property
+    def background(self) -> pygame.Surface:
+        return self.image(self.path)
+
+    def image(self, path: str) -> pygame.Surface:
+        "Returns the decoded image, waiting for the prefetching if needed"
+        thread = self._prefetching.get(path)
+        if thread:
+            thread.join()
+        return self._load(path)
+
+    def _load(self, path: str) -> pygame.Surface:
+        with self._lock:
+            image = self.cache.get(path)
+        if image is None:
+            image = self.loader(path)
+            with self._lock:
+                self.cache.put(path, image)
+        return image
+
+    def _prefetched(self, path: str):
+        try:
+            self._load(path)
+        except LOAD_ERRORS:
+            pass  # loaded again & reported when the image is displayed
+        finally:
+            self._prefetching.pop(path, None)
+
+    def prefetch(self):
+        "Decodes the next image in a background thread"
+        if self.index + 1 >= len(self.paths):
+            return
+        path = self.paths[self.index + 1]
+        with self._lock:
+            if path in self.cache.images or path in self._prefetching:
+                return
+            thread = threading.Thread(
+                target=self._prefetched, args=(path,), daemon=True
+            )
+            self._prefetching[path] = thread
+        thread.start()
+
+    def discard(self, index: int):
+        "Removes an image from the session, eg: when it can't be decoded"
+        self.annotations.pop(self.paths.pop(index), None)
+        if index < self.index:
+            self.index -= 1
+
+    def move(self, offset: int, objects: list[shapes.Shape]) -> bool:
+        """Saves the annotations of the current image and changes to another one
+
+        Returns False if there is no image in that direction"""
+        index = self.index + offset
+        if not 0 <= index < len(self.paths):
+            return False
+        for obj in objects:
+            obj.drop_cache()
+        self.annotations[self.path] = objects
+        self.index = index
+        return True
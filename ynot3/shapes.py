@@ -1,4 +1,7 @@
+import os
 import math
+import weakref
+from collections import OrderedDict
 import pygame
 
 from .colors import BLACK, WHITE
@@ -6,6 +9,11 @@ from .colors import BLACK, WHITE
 WIDGET_SCALE = 1
 SUPERSAMPLE = 4
 
+# Memory allowed for the rendering surfaces, in MB
+RENDER_BUDGET = int(os.environ.get("RENDER_BUDGET", 1024))
+# Print the rendering memory usage on exit
+RENDER_STATS = bool(os.environ.get("RENDER_STATS"))
+
 OUTPUT_FILENAME = "/tmp/annotated.jpg"
 
 
@@ -19,10 +27,102 @@ def make_color_shape(color: tuple[int, int, int], width: int, height: int):
     return pygame.transform.smoothscale(surf, (width, height))
 
 
+class RenderBudget:
+    """Accounts the memory used by the rendering surfaces
+
+    When the limit is reached, the supersampling factor is lowered, then the
+    least recently built shape surfaces are evicted (they are rebuilt when drawn).
+    Allocations still happen if nothing can be freed, making the limit a soft one.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.supersample = SUPERSAMPLE
+        self._scratch: pygame.Surface | None = None
+        self._cached: OrderedDict[int, weakref.ref] = OrderedDict()
+
+    def __str__(self):
+        return "%.1f MB used, %.1f MB peak, %d MB budget, supersample %d" % (
+            self.used / 2**20,
+            self.peak / 2**20,
+            self.limit // 2**20,
+            SUPERSAMPLE,
+        )
+
+    def _free(self, nbytes: int):
+        self.used -= nbytes
+
+    def fits(self, nbytes: int) -> bool:
+        return self.used + nbytes <= self.limit
+
+    def track(self, surface: pygame.Surface, owner=None) -> pygame.Surface:
+        "Accounts `surface` until it is garbage collected, `owner` can drop it"
+        nbytes = surface.get_bytesize() * surface.get_width() * surface.get_height()
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+        weakref.finalize(surface, self._free, nbytes)
+        if owner is not None:
+            self._cached[id(owner)] = weakref.ref(owner)
+            self._cached.move_to_end(id(owner))
+        return surface
+
+    def forget(self, owner):
+        self._cached.pop(id(owner), None)
+
+    def make_room(self, nbytes: int, owner=None) -> bool:
+        "Evicts the cached shape surfaces until `nbytes` fit in the budget"
+        for key in list(self._cached):
+            if self.fits(nbytes):
+                break
+            shape = self._cached[key]()
+            if shape is not owner:
+                del self._cached[key]
+                if shape is not None:
+                    shape.drop_cache()
+        return self.fits(nbytes)
+
+    def surface(self, size: tuple[int, int], flags=0, owner=None) -> pygame.Surface:
+        "Allocates an accounted surface"
+        self.make_room(4 * size[0] * size[1], owner)
+        return self.track(pygame.Surface(size, flags), owner)
+
+    def scratch(self, size: tuple[int, int], owner=None) -> pygame.Surface:
+        """Returns a surface of `size` times SUPERSAMPLE, shared by all shapes
+
+        Its content is undefined, callers clear the area they draw on"""
+        global SUPERSAMPLE
+        ssize = (size[0] * SUPERSAMPLE, size[1] * SUPERSAMPLE)
+        scratch = self._scratch
+        if (
+            scratch is None
+            or scratch.get_width() < ssize[0]
+            or scratch.get_height() < ssize[1]
+        ):
+            self._scratch = scratch = None  # release it before allocating
+            while SUPERSAMPLE > 1 and not self.fits(4 * ssize[0] * ssize[1]):
+                SUPERSAMPLE //= 2
+                ssize = (size[0] * SUPERSAMPLE, size[1] * SUPERSAMPLE)
+            self.make_room(4 * ssize[0] * ssize[1], owner)
+            self._scratch = scratch = self.track(
+                pygame.Surface(ssize, pygame.SRCALPHA)
+            )
+        return scratch.subsurface((0, 0) + ssize)
+
+    def restore(self):
+        "Goes back to the configured supersampling, eg: for a new image"
+        global SUPERSAMPLE
+        SUPERSAMPLE = self.supersample
+        self._scratch = None
+
+
+budget = RenderBudget(RENDER_BUDGET * 2**20)
+
+
 class Shape:
     _name = "unknown"
     _surface = None
-    shadow = (3 * SUPERSAMPLE, 3 * SUPERSAMPLE)
     shadow_color = (0, 0, 0, 150)
 
     def __init__(
@@ -37,6 +137,10 @@ class Shape:
         self.end = end
         self.isDummy = isDummy
 
+    @property
+    def shadow(self):
+        return (3 * SUPERSAMPLE, 3 * SUPERSAMPLE)
+
     @property
     def inv_color(self):
         r, g, b = self.color
@@ -64,13 +168,18 @@ class Shape:
     def instance_removed(self):
         pass
 
+    def drop_cache(self):
+        "Releases the cached rendering, it will be rebuilt on next draw"
+        budget.forget(self)
+        self._surface = None
+
 
 class Arrow(Shape):
     thickness = 5
     arrowhead_size = 20
     _name = "arrow"
     _old_pos = None
-    _ssurface = None
+    _offset = (0, 0)
 
     @property
     def fixed_size(self):
@@ -80,11 +189,15 @@ class Arrow(Shape):
             return self.arrowhead_size * WIDGET_SCALE
 
     def draw(self, surface):
-        start = [SUPERSAMPLE * i for i in self.start]
-        end = [SUPERSAMPLE * i for i in self.end]
+        size = surface.get_size()
+        pos = (tuple(self.start), tuple(self.end), WIDGET_SCALE, SUPERSAMPLE, size)
 
-        if not self._surface or self._old_pos != (start, end, WIDGET_SCALE):
-            self._old_pos = (start, end, WIDGET_SCALE)
+        if not self._surface or self._old_pos != pos:
+            # may lower SUPERSAMPLE
+            ssurface = budget.scratch(size, self)
+            self._old_pos = (*pos[:3], SUPERSAMPLE, size)
+            start = [SUPERSAMPLE * i for i in self.start]
+            end = [SUPERSAMPLE * i for i in self.end]
 
             if self.isDummy:
                 # add some padding
@@ -95,13 +208,6 @@ class Arrow(Shape):
 
             # Calculate the angle of the line from start to end
             angle = math.atan2(end[1] - start[1], end[0] - start[0])
-            if not self._ssurface:
-                supersampled_surface = pygame.Surface(
-                    tuple(SUPERSAMPLE * i for i in surface.get_size()), pygame.SRCALPHA
-                )
-                self._ssurface = supersampled_surface
-            else:
-                self._ssurface.fill((0, 0, 0, 0))
 
             # Calculate the endpoint of the line from start to end
             line_length = math.sqrt((end[1] - start[1]) ** 2 + (end[0] - start[0]) ** 2)
@@ -118,10 +224,25 @@ class Arrow(Shape):
                     * SUPERSAMPLE
                     * (WIDGET_SCALE * 0.5 if WIDGET_SCALE > 1 else 1)
                 )
+
+            # only render & cache the area covered by the arrow
+            margin = int(sz / SUPERSAMPLE) + (self.thickness + 5) * WIDGET_SCALE + 4
+            area = pygame.Rect(
+                min(self.start[0], self.end[0]) - margin,
+                min(self.start[1], self.end[1]) - margin,
+                abs(self.end[0] - self.start[0]) + 2 * margin,
+                abs(self.end[1] - self.start[1]) + 2 * margin,
+            ).clip(pygame.Rect((0, 0), size))
+            if not area.width or not area.height:
+                area = pygame.Rect(0, 0, 1, 1)
+            sarea = pygame.Rect(
+                [SUPERSAMPLE * i for i in (area.x, area.y, area.width, area.height)]
+            )
+            ssurface.fill((0, 0, 0, 0), sarea)
             # shadow
             if not self.isDummy:
                 pygame.draw.polygon(
-                    self._ssurface,
+                    ssurface,
                     self.shadow_color,
                     (
                         end_point,
@@ -146,7 +267,7 @@ class Arrow(Shape):
                 )
                 # Draw the line from start to end
                 pygame.draw.line(
-                    self._ssurface,
+                    ssurface,
                     self.shadow_color,
                     start,
                     send_point,
@@ -155,14 +276,14 @@ class Arrow(Shape):
             # real shape
             # Draw a circle t point A
             pygame.draw.circle(
-                self._ssurface,
+                ssurface,
                 self.color,
                 start,
                 2 * (1 if self.isDummy else WIDGET_SCALE * SUPERSAMPLE),
             )
             # Draw the arrowhead at point B
             pygame.draw.polygon(
-                self._ssurface,
+                ssurface,
                 self.color,
                 (
                     (end_point[0], end_point[1]),
@@ -183,16 +304,20 @@ class Arrow(Shape):
             )
             # Draw the line from start to end
             pygame.draw.line(
-                self._ssurface,
+                ssurface,
                 self.color,
                 start,
                 end_point,
                 self.thickness * (2 if self.isDummy else WIDGET_SCALE * SUPERSAMPLE),
             )
-            self._surface = pygame.transform.smoothscale(
-                self._ssurface, surface.get_size()
+            self._surface = None  # release it before allocating
+            budget.make_room(4 * area.width * area.height, self)
+            self._surface = budget.track(
+                pygame.transform.smoothscale(ssurface.subsurface(sarea), area.size),
+                self,
             )
-        surface.blit(self._surface, (0, 0))
+            self._offset = area.topleft
+        surface.blit(self._surface, self._offset)
 
 
 class Bullet(Shape):
@@ -269,7 +394,9 @@ class Bullet(Shape):
             pos[1] -= text_size[1] // 2
             supersampled_surface.blit(self.text, pos)
             sz = self.rect.size[0] if self.isDummy else (self.size * WIDGET_SCALE * 2)
-            self._surface = pygame.transform.smoothscale(supersampled_surface, (sz, sz))
+            self._surface = budget.track(
+                pygame.transform.smoothscale(supersampled_surface, (sz, sz)), self
+            )
 
         if self.isDummy:
             surface.blit(